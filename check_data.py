@@ -2,19 +2,42 @@
 import pandas as pd
 import numpy as np
 
-df = pd.read_csv("data.csv")
-# Filter for meal entries - they have meal_type values like 'dinner', 'snack', etc.
-meals = df[df["meal_type"].notna()].copy()
-for col in ["protein_g","carbs_g","fat_g","calories_kcal"]:
-    if col not in meals.columns:
-        meals[col] = np.nan
+# Only load the columns inspected below. Macro columns get no forced dtype so a malformed
+# cell (e.g. "~300") shows up as a problem row instead of aborting the read
+DTYPES = {"date": "string", "meal_type": "category", "items": "string", "quantities": "string"}
+MACRO_COLS = ["protein_g","carbs_g","fat_g","calories_kcal"]
+# Rows per chunk; counts are accumulated so large logs never load in full
+CHUNK_ROWS = 1_000_000
 
-print("Total rows:", len(df))
-print("Meal rows:", len(meals))
-print("With all macros present:", meals[["protein_g","carbs_g","fat_g"]].notna().all(axis=1).sum())
-print("With calories present:", meals["calories_kcal"].notna().sum())
+total_rows = meal_rows = with_macros = with_calories = usable = 0
+problem_rows = []
+with pd.read_csv("data.csv", usecols=lambda col: col in DTYPES or col in MACRO_COLS, dtype=DTYPES,
+                 chunksize=CHUNK_ROWS) as reader:
+    for df in reader:
+        # Filter for meal entries - they have meal_type values like 'dinner', 'snack', etc.
+        meals = df[df["meal_type"].notna()].copy()
+        for col in MACRO_COLS:
+            if col not in meals.columns:
+                meals[col] = np.nan
+        # Unparseable values count as missing; problem rows still print the raw cells
+        numeric = meals[MACRO_COLS].apply(pd.to_numeric, errors="coerce")
 
-mask_full = meals[["protein_g","carbs_g","fat_g","calories_kcal"]].notna().all(axis=1)
-print("Usable rows (macros + calories):", mask_full.sum())
+        total_rows += len(df)
+        meal_rows += len(meals)
+        with_macros += numeric[["protein_g","carbs_g","fat_g"]].notna().all(axis=1).sum()
+        with_calories += numeric["calories_kcal"].notna().sum()
+
+        mask_full = numeric.notna().all(axis=1)
+        usable += mask_full.sum()
+        # Only the first 10 problem rows are shown, so stop collecting once we have them
+        if sum(len(rows) for rows in problem_rows) < 10:
+            problem_rows.append(meals[~mask_full].head(10))
+
+print("Total rows:", total_rows)
+print("Meal rows:", meal_rows)
+print("With all macros present:", with_macros)
+print("With calories present:", with_calories)
+
+print("Usable rows (macros + calories):", usable)
 print("\nFirst 10 problem rows missing any of macros/calories:")
-print(meals[~mask_full].head(10)[["date","meal_type","items","quantities","protein_g","carbs_g","fat_g","calories_kcal"]])
+print(pd.concat(problem_rows).head(10)[["date","meal_type","items","quantities","protein_g","carbs_g","fat_g","calories_kcal"]])
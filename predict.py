@@ -1,75 +1,178 @@
 # predict.py
-import os, sys, joblib, json
-import numpy as np
+import os, sys, re, json, functools, importlib.util
 
-MODEL_PATH = os.path.join(os.path.dirname(__file__), "models", "model_xgb.pkl")
+MODEL_PATH = os.path.join(os.path.dirname(__file__), "models", "model_xgb.ubj")
+PICKLE_PATH = os.path.join(os.path.dirname(__file__), "models", "model_xgb.pkl")
+ONNX_PATH = os.path.join(os.path.dirname(__file__), "models", "model_xgb.onnx")
 META_PATH = os.path.join(os.path.dirname(__file__), "models", "metadata.json")
 PROFILE_PATH = os.path.join(os.path.dirname(__file__), "profile.json")
 
-def ensure_model():
-    if not os.path.exists(MODEL_PATH):
-        sys.exit(f"❌ Model not found at {MODEL_PATH}. Train first:  python train.py")
-    if os.path.getsize(MODEL_PATH) < 1024:
-        sys.exit(f"❌ Model file looks too small: {MODEL_PATH}")
-    print(f"✅ Using model: {MODEL_PATH}")
-
-def load_profile():
-    """Load user profile for personalization features"""
-    if not os.path.exists(PROFILE_PATH):
-        return None
+# (metadata, loaded model); the model is reused until train.py rewrites metadata.json
+_MODEL_CACHE = (None, None)
+# (profile, compiled preference patterns) for the most recently seen profile
+_PREFERENCE_CACHE = (None, None)
+# Thread count currently configured on the cached booster
+_BOOSTER_THREADS = None
+
+# Batches smaller than this predict on one thread; spinning up a thread pool costs
+# more than the parallel tree traversal saves for a handful of rows
+PARALLEL_MIN_ROWS = 256
+
+@functools.lru_cache(maxsize=4)
+def _read_json(path, mtime_ns):
+    """Parse a JSON file; the mtime key drops the cached copy once the file changes"""
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def _shared_metadata():
+    """Cached metadata shared across calls; internal read-only use only"""
     try:
-        with open(PROFILE_PATH, 'r', encoding='utf-8') as f:
-            return json.load(f)
+        return _read_json(META_PATH, os.stat(META_PATH).st_mtime_ns)
     except:
-        return None
+        return {}
 
-def predict_with_profile(protein_g, carbs_g, fat_g, items=""):
-    """Predict calories with profile integration"""
-    model = joblib.load(MODEL_PATH)
-    
-    # Load metadata to get feature schema
+def _shared_profile():
+    """Cached profile shared across calls; internal read-only use only"""
     try:
-        with open(META_PATH, 'r', encoding='utf-8') as f:
-            metadata = json.load(f)
-        feature_cols = metadata.get("schema", ["protein_g","carbs_g","fat_g"])
+        return _read_json(PROFILE_PATH, os.stat(PROFILE_PATH).st_mtime_ns)
     except:
-        feature_cols = ["protein_g","carbs_g","fat_g"]
+        return None
+
+def get_model_path(metadata):
+    """Resolve the model file from the format recorded at training time"""
+    # Metadata written before the UBJSON switch has no format and points at a pickle
+    return MODEL_PATH if metadata.get("model_format") == "ubj" else PICKLE_PATH
+
+def ensure_model():
+    metadata = _shared_metadata()
+    if not metadata:
+        sys.exit(f"❌ Model metadata not found at {META_PATH}. Train first:  python train.py")
+    model_path = get_model_path(metadata)
+    # train.py records the model size; only older metadata needs the file probed
+    model_size = metadata.get("model_size")
+    if model_size is None:
+        if not os.path.exists(model_path):
+            sys.exit(f"❌ Model not found at {model_path}. Train first:  python train.py")
+        model_size = os.path.getsize(model_path)
+    if model_size < 1024:
+        sys.exit(f"❌ Model file looks too small: {model_path}")
+    # Report the artifact load_model will try first
+    if metadata.get("onnx_export") and importlib.util.find_spec("onnxruntime"):
+        model_path = ONNX_PATH
+    print(f"✅ Using model: {model_path}")
+
+def load_model(metadata):
+    """Load the trained model once per training run"""
+    global _MODEL_CACHE, _BOOSTER_THREADS
+    cached_metadata, model = _MODEL_CACHE
+    if cached_metadata is not metadata:
+        # Heavy imports are deferred so ensure_model() and error paths stay fast.
+        # An ONNX export runs on onnxruntime, which loads faster and needs no xgboost
+        model = None
+        if metadata.get("onnx_export") and importlib.util.find_spec("onnxruntime"):
+            try:
+                import onnxruntime as ort
+                model = ort.InferenceSession(ONNX_PATH, providers=["CPUExecutionProvider"])
+            except Exception:
+                pass  # Broken onnxruntime or missing/unreadable export; fall back below
+        if model is None:
+            # ensure_model trusts the recorded size, so a missing file surfaces here
+            model_path = get_model_path(metadata)
+            missing = f"❌ Model not found at {model_path}. Train first:  python train.py"
+            if model_path == MODEL_PATH:
+                from xgboost import XGBRegressor
+                from xgboost.core import XGBoostError
+                model = XGBRegressor()
+                try:
+                    model.load_model(model_path)
+                except (OSError, XGBoostError):
+                    sys.exit(missing)
+            else:
+                import joblib
+                try:
+                    model = joblib.load(model_path)
+                except OSError:
+                    sys.exit(missing)
+        # XGBoost models predict through the raw booster, which skips the sklearn
+        # wrapper's input checks and per-call DMatrix construction
+        if hasattr(model, "get_booster"):
+            model = model.get_booster()
+            _BOOSTER_THREADS = None
+        _MODEL_CACHE = (metadata, model)
+    return model
+
+def set_booster_threads(booster, n_rows):
+    """Match the booster's thread count to the batch size, touching it only on change"""
+    global _BOOSTER_THREADS
+    nthread = 1 if n_rows < PARALLEL_MIN_ROWS else (os.cpu_count() or 1)
+    if nthread != _BOOSTER_THREADS:
+        booster.set_param({"nthread": nthread})
+        _BOOSTER_THREADS = nthread
+
+def get_preference_patterns(profile):
+    """Compile the favorite foods/snacks/grocery lists into one regex each per loaded profile"""
+    global _PREFERENCE_CACHE
+    cached_profile, patterns = _PREFERENCE_CACHE
+    if cached_profile is not profile:
+        preferences = profile.get("preferences", {})
+        # An empty list gets no pattern, since an empty regex would match everything
+        patterns = tuple(
+            re.compile("|".join(re.escape(term.lower()) for term in terms)) if terms else None
+            for terms in (preferences.get(key, [])
+                          for key in ("favorite_foods", "favorite_snacks", "grocery_items"))
+        )
+        _PREFERENCE_CACHE = (profile, patterns)
+    return patterns
+
+def predict_batch(rows):
+    """Predict calories for many meals with a single model call
+
+    Each row is a dict with protein_g, carbs_g, fat_g and optionally items.
+    """
+    import numpy as np
+
+    if not rows:
+        return np.empty(0, dtype=np.float32)
+
+    # Load metadata to get feature schema and model format. The shared cached objects
+    # are used read-only so the identity-keyed model/preference caches keep hitting
+    metadata = _shared_metadata()
+    feature_cols = metadata.get("schema", ["protein_g","carbs_g","fat_g"])
+    model = load_model(metadata)
     
     # Load profile
-    profile = load_profile()
+    profile = _shared_profile()
     
-    # Build feature vector
-    features = [protein_g, carbs_g, fat_g]
+    # Build feature matrix; unused trailing features stay zero
+    X = np.zeros((len(rows), len(feature_cols)), dtype=np.float32)
+    X[:, 0:3] = [(row["protein_g"], row["carbs_g"], row["fat_g"]) for row in rows]
     
     # Add profile features if available
     if profile and profile.get("preferences") and len(feature_cols) > 3:
-        favorite_foods = set(profile["preferences"].get("favorite_foods", []))
-        favorite_snacks = set(profile["preferences"].get("favorite_snacks", []))
-        grocery_items = set(profile["preferences"].get("grocery_items", []))
-        
-        has_favorite_food = 1 if any(food.lower() in items.lower() for food in favorite_foods) else 0
-        has_favorite_snack = 1 if any(snack.lower() in items.lower() for snack in favorite_snacks) else 0
-        has_grocery_item = 1 if any(item.lower() in items.lower() for item in grocery_items) else 0
+        patterns = get_preference_patterns(profile)
+        for i, row in enumerate(rows):
+            items_lower = (row.get("items") or "").lower()
+            X[i, 3:6] = [pattern is not None and pattern.search(items_lower) is not None
+                         for pattern in patterns]
         
         macro_prefs = profile.get("dietary_patterns", {}).get("macro_preferences", {})
-        profile_protein_ratio = macro_prefs.get("protein_ratio", 0.0)
-        profile_carbs_ratio = macro_prefs.get("carbs_ratio", 0.0)
-        profile_fat_ratio = macro_prefs.get("fat_ratio", 0.0)
-        
         learning_metrics = profile.get("learning_metrics", {})
-        personalization_score = learning_metrics.get("personalization_score", 0.0)
-        
-        features.extend([has_favorite_food, has_favorite_snack, has_grocery_item,
-                        profile_protein_ratio, profile_carbs_ratio, profile_fat_ratio,
-                        personalization_score])
-    
-    # Pad with zeros if needed
-    while len(features) < len(feature_cols):
-        features.append(0.0)
+        X[:, 6:10] = (macro_prefs.get("protein_ratio", 0.0),
+                      macro_prefs.get("carbs_ratio", 0.0),
+                      macro_prefs.get("fat_ratio", 0.0),
+                      learning_metrics.get("personalization_score", 0.0))
     
-    X = np.array([features])
-    yhat = model.predict(X)
-    return float(yhat[0])
+    if hasattr(model, "run"):  # onnxruntime session
+        return model.run(None, {"input": X})[0].ravel()
+    if hasattr(model, "inplace_predict"):
+        set_booster_threads(model, len(rows))
+        return model.inplace_predict(X)
+    return model.predict(X)
+
+def predict_with_profile(protein_g, carbs_g, fat_g, items=""):
+    """Predict calories with profile integration"""
+    rows = [{"protein_g": protein_g, "carbs_g": carbs_g, "fat_g": fat_g, "items": items}]
+    return float(predict_batch(rows)[0])
 
 def predict_example():
     # Input = [protein_g, carbs_g, fat_g]
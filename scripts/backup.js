@@ -20,6 +20,8 @@ const createBackup = () => {
       { source: './data.csv', name: 'data' },
       { source: './profile.json', name: 'profile' },
       { source: './models/model_xgb.pkl', name: 'model' },
+      { source: './models/model_xgb.ubj', name: 'model_ubj' },
+      { source: './models/model_xgb.onnx', name: 'model_onnx' },
       { source: './models/metadata.json', name: 'metadata' }
     ];
     
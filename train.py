@@ -1,27 +1,42 @@
 # train.py
-import json, os, time, joblib
+import json, os, re, copy, time, functools, importlib.util, joblib
 import pandas as pd
 import numpy as np
-from sklearn.model_selection import train_test_split, KFold, LeaveOneOut
-from sklearn.metrics import r2_score, mean_absolute_error
-from sklearn.linear_model import LinearRegression
+import xgboost as xgb
 from xgboost import XGBRegressor
 
 ARTIFACT_DIR = os.path.join(os.path.dirname(__file__), "models")
-MODEL_PATH   = os.path.join(ARTIFACT_DIR, "model_xgb.pkl")
+MODEL_PATH   = os.path.join(ARTIFACT_DIR, "model_xgb.ubj")
+PICKLE_PATH  = os.path.join(ARTIFACT_DIR, "model_xgb.pkl")
+ONNX_PATH    = os.path.join(ARTIFACT_DIR, "model_xgb.onnx")
 META_PATH    = os.path.join(ARTIFACT_DIR, "metadata.json")
 DATA_PATH    = os.path.join(os.path.dirname(__file__), "data.csv")
 PROFILE_PATH = os.path.join(os.path.dirname(__file__), "profile.json")
 
+# Arrow-backed strings let .str.lower()/.str.contains run in Arrow compute kernels
+# instead of iterating Python objects; fall back to the plain string dtype without pyarrow
+ITEMS_DTYPE = "string[pyarrow]" if importlib.util.find_spec("pyarrow") else "string"
+
+# Only the columns load_frame uses, with explicit dtypes so pandas skips type inference
+MEAL_DTYPES = {"date": "string", "meal_type": "category", "items": ITEMS_DTYPE,
+               "protein_g": "float32", "carbs_g": "float32", "fat_g": "float32",
+               "calories_kcal": "float32"}
+# Rows per read_csv chunk; bounds peak memory when data.csv grows large
+CSV_CHUNK_ROWS = 1_000_000
+
 os.makedirs(ARTIFACT_DIR, exist_ok=True)
 
+@functools.lru_cache(maxsize=1)
+def _read_profile(mtime_ns):
+    """Parse profile.json; the mtime key drops the cached copy once the file changes"""
+    with open(PROFILE_PATH, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
 def load_profile():
     """Load user profile for personalization features"""
-    if not os.path.exists(PROFILE_PATH):
-        return None
     try:
-        with open(PROFILE_PATH, 'r', encoding='utf-8') as f:
-            return json.load(f)
+        # Hand out a copy so callers that edit the profile cannot corrupt the cached parse
+        return copy.deepcopy(_read_profile(os.stat(PROFILE_PATH).st_mtime_ns))
     except:
         return None
 
@@ -72,29 +87,86 @@ def update_profile_metrics(metrics, n_samples, model_confidence):
     except Exception as e:
         print(f"[WARNING] Could not update profile: {e}")
 
-def load_frame():
-    df = pd.read_csv(DATA_PATH)
-    profile = load_profile()
+def synthesize_calories(macros):
+    """Calories from an (n, 3) float32 protein/carbs/fat block using 4/4/9"""
+    return macros @ np.array([4, 4, 9], dtype=np.float32)
+
+# Regex metacharacters; escaping only these keeps patterns valid for both Python's re
+# and Arrow's RE2 engine (re.escape also escapes spaces, which RE2 rejects)
+REGEX_SPECIAL = re.compile(r"([\\.^$|?*+()\[\]{}])")
+
+def contains_any(items_lower, terms):
+    """Flag rows whose lowercased items mention any of the given terms"""
+    # An empty pattern would match every row, so no terms means no matches
+    if not terms:
+        return pd.Series(0, index=items_lower.index, dtype=np.int8)
+    pattern = "|".join(REGEX_SPECIAL.sub(r"\\\1", term.lower()) for term in terms)
+    return items_lower.str.contains(pattern, regex=True, na=False).astype(np.int8)
+
+def export_onnx(model, X):
+    """Export an XGBoost model to ONNX for onnxruntime inference, if onnxmltools is installed
+
+    The export is kept only if onnxruntime reproduces the booster's predictions on X.
+    """
+    if not (importlib.util.find_spec("onnxmltools") and importlib.util.find_spec("onnxruntime")):
+        return False
+    try:
+        # Imported inside the try so an installed-but-broken package skips the export
+        # instead of aborting training before metadata.json is written
+        from onnxmltools.convert import convert_xgboost
+        from onnxmltools.convert.common.data_types import FloatTensorType
+        import onnxruntime as ort
+        onnx_model = convert_xgboost(model, initial_types=[("input", FloatTensorType([None, X.shape[1]]))])
+        with open(ONNX_PATH, "wb") as f:
+            f.write(onnx_model.SerializeToString())
+        # Converters have dropped base_score before, shifting every prediction by a constant
+        session = ort.InferenceSession(ONNX_PATH, providers=["CPUExecutionProvider"])
+        onnx_pred = session.run(None, {"input": X})[0].ravel()
+        booster = model.get_booster() if hasattr(model, "get_booster") else model
+        xgb_pred = booster.inplace_predict(X)
+        if not np.allclose(onnx_pred, xgb_pred, rtol=1e-4, atol=1e-4):
+            max_diff = float(np.max(np.abs(onnx_pred - xgb_pred)))
+            raise ValueError(f"ONNX predictions differ from XGBoost (max abs diff {max_diff:.4g})")
+    except Exception as e:
+        print(f"[WARNING] Could not export ONNX model: {e}")
+        if os.path.exists(ONNX_PATH):
+            os.remove(ONNX_PATH)
+        return False
+    print(f"[INFO] ONNX model saved to: {ONNX_PATH}")
+    return True
 
-    # Filter for meal entries - they have meal_type values like 'dinner', 'snack', etc.
-    meals = df[df["meal_type"].notna()].copy()
+def prepare_meals(df):
+    """Reduce one chunk of data.csv to meal rows with complete macros + calories"""
     for col in ["protein_g", "carbs_g", "fat_g", "calories_kcal"]:
-        if col not in meals.columns:
-            meals[col] = np.nan
+        if col not in df.columns:
+            df[col] = np.nan
+
+    # Meal entries have meal_type values like 'dinner', 'snack', etc.
+    is_meal = df["meal_type"].notna()
 
     # If calories missing but macros present, synthesize with 4/4/9
-    need_cals = meals["calories_kcal"].isna()
-    have_macros = meals[["protein_g","carbs_g","fat_g"]].notna().all(axis=1)
-    synth_mask = need_cals & have_macros
-    meals.loc[synth_mask, "calories_kcal"] = (
-        4*meals.loc[synth_mask, "protein_g"] +
-        4*meals.loc[synth_mask, "carbs_g"] +
-        9*meals.loc[synth_mask, "fat_g"]
-    )
-    meals["label_is_synthetic"] = synth_mask & meals["calories_kcal"].notna()
-
-    # keep rows with complete macros + calories now (real or synthetic)
-    meals = meals.dropna(subset=["protein_g","carbs_g","fat_g","calories_kcal"]).copy()
+    need_cals = df["calories_kcal"].isna()
+    have_macros = df[["protein_g","carbs_g","fat_g"]].notna().all(axis=1)
+    synth_mask = is_meal & need_cals & have_macros
+    macros = df.loc[synth_mask, ["protein_g","carbs_g","fat_g"]].to_numpy(np.float32, copy=False)
+    df.loc[synth_mask, "calories_kcal"] = synthesize_calories(macros)
+    df["label_is_synthetic"] = synth_mask
+
+    # Keep meal rows with complete macros + calories now (real or synthetic); filtering
+    # once here avoids materializing an intermediate meals frame plus defensive copies
+    complete = df[["protein_g","carbs_g","fat_g","calories_kcal"]].notna().all(axis=1)
+    return df.loc[is_meal & complete]
+
+def load_frame():
+    # Stream the CSV so peak memory is one chunk plus the kept meal rows, not the whole log.
+    # A callable usecols tolerates missing macro columns (prepare_meals adds them)
+    with pd.read_csv(DATA_PATH, usecols=lambda col: col in MEAL_DTYPES, dtype=MEAL_DTYPES,
+                     chunksize=CSV_CHUNK_ROWS) as reader:
+        chunks = [prepare_meals(chunk) for chunk in reader]
+    if not chunks:
+        raise SystemExit(f"❌ No rows found in {DATA_PATH}.")
+    meals = chunks[0] if len(chunks) == 1 else pd.concat(chunks)
+    profile = load_profile()
 
     # Add profile-based features
     if profile and profile.get("preferences"):
@@ -103,40 +175,35 @@ def load_frame():
         favorite_snacks = set(profile["preferences"].get("favorite_snacks", []))
         grocery_items = set(profile["preferences"].get("grocery_items", []))
         
-        meals["has_favorite_food"] = meals["items"].apply(
-            lambda x: any(food.lower() in str(x).lower() for food in favorite_foods) if pd.notna(x) else False
-        ).astype(int)
-        meals["has_favorite_snack"] = meals["items"].apply(
-            lambda x: any(snack.lower() in str(x).lower() for snack in favorite_snacks) if pd.notna(x) else False
-        ).astype(int)
-        meals["has_grocery_item"] = meals["items"].apply(
-            lambda x: any(item.lower() in str(x).lower() for item in grocery_items) if pd.notna(x) else False
-        ).astype(int)
+        # Lowercase once and scan each preference set with a single regex
+        items_lower = meals["items"].str.lower()
+        meals = meals.assign(has_favorite_food=contains_any(items_lower, favorite_foods),
+                             has_favorite_snack=contains_any(items_lower, favorite_snacks),
+                             has_grocery_item=contains_any(items_lower, grocery_items))
         
-        # Use profile macro preferences as features
+        # Use profile macro preferences and personalization score as features
         macro_prefs = profile.get("dietary_patterns", {}).get("macro_preferences", {})
-        meals["profile_protein_ratio"] = macro_prefs.get("protein_ratio", 0.0)
-        meals["profile_carbs_ratio"] = macro_prefs.get("carbs_ratio", 0.0)
-        meals["profile_fat_ratio"] = macro_prefs.get("fat_ratio", 0.0)
-        
-        # Add personalization score as feature
         learning_metrics = profile.get("learning_metrics", {})
-        meals["personalization_score"] = learning_metrics.get("personalization_score", 0.0)
+        profile_values = [macro_prefs.get("protein_ratio", 0.0),
+                          macro_prefs.get("carbs_ratio", 0.0),
+                          macro_prefs.get("fat_ratio", 0.0),
+                          learning_metrics.get("personalization_score", 0.0)]
     else:
         # Default values when no profile
-        meals["has_favorite_food"] = 0
-        meals["has_favorite_snack"] = 0
-        meals["has_grocery_item"] = 0
-        meals["profile_protein_ratio"] = 0.0
-        meals["profile_carbs_ratio"] = 0.0
-        meals["profile_fat_ratio"] = 0.0
-        meals["personalization_score"] = 0.0
+        meals = meals.assign(has_favorite_food=np.int8(0), has_favorite_snack=np.int8(0),
+                             has_grocery_item=np.int8(0))
+        profile_values = [0.0, 0.0, 0.0, 0.0]
 
     # Feature matrix includes both original macros and profile features
     feature_cols = ["protein_g","carbs_g","fat_g","has_favorite_food","has_favorite_snack","has_grocery_item",
                    "profile_protein_ratio","profile_carbs_ratio","profile_fat_ratio","personalization_score"]
-    X = meals[feature_cols].astype(float).values
-    y = meals["calories_kcal"].astype(float).values
+    # Profile values are constant per run, so broadcast them into a preallocated
+    # float32 matrix instead of materializing full-length DataFrame columns
+    X = np.empty((len(meals), len(feature_cols)), dtype=np.float32)
+    X[:, 0:3] = meals[["protein_g","carbs_g","fat_g"]].to_numpy(np.float32, copy=False)
+    X[:, 3:6] = meals[["has_favorite_food","has_favorite_snack","has_grocery_item"]].to_numpy(np.float32)
+    X[:, 6:10] = np.array(profile_values, dtype=np.float32)
+    y = meals["calories_kcal"].to_numpy(np.float32)
     return meals, X, y, feature_cols
 
 def main():
@@ -150,39 +217,55 @@ def main():
     metrics = {}
 
     if n >= 10:
-        X_tr, X_te, y_tr, y_te = train_test_split(X, y, test_size=0.25, random_state=42)
+        # Shuffled 75/25 split; plain numpy keeps sklearn out of the common path
+        idx = np.random.default_rng(42).permutation(n)
+        tr, te = idx[:int(n * 0.75)], idx[int(n * 0.75):]
+        X_tr, X_te, y_tr, y_te = X[tr], X[te], y[tr], y[te]
         model = XGBRegressor(n_estimators=300, max_depth=4, learning_rate=0.08,
                              subsample=0.9, colsample_bytree=0.9, random_state=42)
         model.fit(X_tr, y_tr)
         yp = model.predict(X_te)
-        metrics["r2"] = float(r2_score(y_te, yp))
-        metrics["mae"] = float(mean_absolute_error(y_te, yp))
+        ss_res = np.sum((y_te - yp)**2)
+        ss_tot = np.sum((y_te - y_te.mean())**2)
+        metrics["r2"] = float(1 - ss_res / ss_tot) if ss_tot > 0 else float("nan")
+        metrics["mae"] = float(np.mean(np.abs(y_te - yp)))
         cv_note = "holdout 25%"
     elif n >= 3:
         # Small dataset → CV
-        k = 3 if n >= 6 else n
-        model = XGBRegressor(n_estimators=200, max_depth=3, learning_rate=0.1,
-                             subsample=0.9, colsample_bytree=0.9, random_state=42)
-        r2s, maes = [], []
-        splitter = (KFold(n_splits=k, shuffle=True, random_state=42)
-                    if n >= 6 else LeaveOneOut())
-        for tr, te in splitter.split(X):
-            model.fit(X[tr], y[tr])
-            yp = model.predict(X[te])
-            r2s.append(r2_score(y[te], yp) if len(te) > 1 else float("nan"))
-            maes.append(mean_absolute_error(y[te], yp))
-        metrics["r2_mean"]  = float(np.nanmean(r2s))
-        metrics["mae_mean"] = float(np.mean(maes))
+        k = 3 if n >= 6 else n  # k = n folds is leave-one-out
+        params = {"max_depth": 3, "learning_rate": 0.1, "subsample": 0.9,
+                  "colsample_bytree": 0.9, "random_state": 42}
+        # Build the DMatrix once: xgb.cv trains every fold on DMatrix.slice views of it
+        # (no X[tr] copies) and the final fit below reuses it unchanged
+        dall = xgb.DMatrix(X, label=y)
+        cv_res = xgb.cv(params, dall, num_boost_round=200, nfold=k,
+                        metrics=["rmse", "mae"], seed=42)
+        last = cv_res.iloc[-1]
+        # Mean fold MSE is mean(rmse)^2 + std(rmse)^2; R² is pooled against the label variance
+        fold_mse = last["test-rmse-mean"]**2 + last["test-rmse-std"]**2
+        label_var = np.var(y)
+        metrics["r2_mean"]  = float(1 - fold_mse / label_var) if label_var > 0 else float("nan")
+        metrics["mae_mean"] = float(last["test-mae-mean"])
         cv_note = "KFold CV" if n >= 6 else "LOO CV"
-        model.fit(X, y)  # final fit on all data
+        model = xgb.train(params, dall, num_boost_round=200)  # final fit on all data
     else:
-        # n = 1–2 → linear baseline
+        # n = 1–2 → linear baseline (the only remaining sklearn use)
+        from sklearn.linear_model import LinearRegression
         model = LinearRegression()
         model.fit(X, y)
         metrics["r2"] = float("nan"); metrics["mae"] = float("nan")
         cv_note = "baseline (too few samples)"
 
-    joblib.dump(model, MODEL_PATH)
+    # XGBoost models use the native UBJSON format (much faster to load than a pickle);
+    # only the linear baseline still goes through joblib
+    if isinstance(model, (XGBRegressor, xgb.Booster)):
+        model_path, model_format = MODEL_PATH, "ubj"
+        model.save_model(model_path)
+        onnx_export = export_onnx(model, X)
+    else:
+        model_path, model_format = PICKLE_PATH, "pkl"
+        joblib.dump(model, model_path)
+        onnx_export = False
     # Calculate feature importance (mock for now - would be real from model)
     feature_importance = {}
     for i, feature in enumerate(feature_cols):
@@ -195,7 +278,10 @@ def main():
 
     metadata = {
         "saved_at": time.strftime("%Y-%m-%d %H:%M:%S"),
-        "model_path": MODEL_PATH,
+        "model_path": model_path,
+        "model_format": model_format,
+        "model_size": os.path.getsize(model_path),
+        "onnx_export": onnx_export,
         "n_samples": int(n),
         "cv_note": cv_note,
         "metrics": metrics,
@@ -213,7 +299,7 @@ def main():
     with open(META_PATH, "w", encoding="utf-8") as f:
         json.dump(metadata, f, indent=2)
 
-    print(f"[SUCCESS] Model saved to: {MODEL_PATH}")
+    print(f"[SUCCESS] Model saved to: {model_path}")
     print(f"[INFO] Metadata saved to: {META_PATH}")
     print(f"[METRICS] {metadata['metrics']} ({cv_note})")
     